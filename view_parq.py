@@ -1,261 +1,322 @@
+import mmap
+import os
+import stat
 import struct
 import sys
-from datetime import datetime
-from typing import List, Tuple
+import time
+from array import array
+from itertools import accumulate, compress, repeat
+from operator import ne
+from typing import Callable, List, Optional, Tuple
 
 MAGIC_NUMBER = 0x50415251
 HEADER_SIZE = 32
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_HEADER = struct.Struct('<IIQI4s')
+_FOOTER_HEAD = struct.Struct('<II')
+_COL_TAIL = struct.Struct('<IQQQ')
+_LEN = struct.Struct('<I')
+# Footer head plus the "timestamp" and "value" column descriptors
+_FOOTER_FIXED = struct.Struct('<II I9s IQQQ I5s IQQQ')
+
+# (name, type, offset, size, count) of one footer column descriptor
+ColumnMeta = Tuple[str, int, int, int, int]
+
+
+# sign_extend specialised for the delta-of-delta payload widths, with the
+# sign bit baked in as a literal
+def _sign_extend_7(value: int) -> int:
+    return (value ^ 0x40) - 0x40
+
+
+def _sign_extend_9(value: int) -> int:
+    return (value ^ 0x100) - 0x100
+
+
+def _sign_extend_12(value: int) -> int:
+    return (value ^ 0x800) - 0x800
+
+
+def _sign_extend_64(value: int) -> int:
+    return (value ^ 0x8000000000000000) - 0x8000000000000000
+
+
+def _dod_entry(prefix: int) -> Tuple[int, int, Optional[Callable[[int], int]]]:
+    # (prefix length, payload bits, sign extender) for the delta-of-delta
+    # control code starting a 5-bit window: 0, 10, 110, 1110 or 1111
+    if prefix >> 4 == 0b0:
+        return 1, 0, None
+    if prefix >> 3 == 0b10:
+        return 2, 7, _sign_extend_7
+    if prefix >> 2 == 0b110:
+        return 3, 9, _sign_extend_9
+    if prefix >> 1 == 0b1110:
+        return 4, 12, _sign_extend_12
+    return 4, 64, _sign_extend_64
+
+
+_DOD_TABLE = [_dod_entry(prefix) for prefix in range(32)]
 
 
 class BitReader:
     
+    __slots__ = ('data', 'pos', 'buf', 'nbits')
+    
     def __init__(self, data: bytes):
         self.data = data
         self.pos = 0
-        self.bit_pos = 0
-    
-    def read_bits(self, num_bits: int) -> Tuple[int, bool]:
-        if self.pos >= len(self.data):
-            return 0, False
+        self.buf = 0
+        self.nbits = 0
+    
+    def _refill(self):
+        # Callers only refill when fewer bits are buffered than a read of at
+        # most 64 needs, so buf never grows past 127 bits
+        chunk = self.data[self.pos:self.pos + 8]
+        self.pos += len(chunk)
+        self.buf = (self.buf << (len(chunk) << 3)) | int.from_bytes(chunk, 'big')
+        self.nbits += len(chunk) << 3
+    
+    def read_bits(self, num_bits: int) -> int:
+        if self.nbits < num_bits:
+            self._refill()
+            if self.nbits < num_bits:
+                raise EOFError("Unexpected end of compressed data")
         
-        result = 0
-        bits_remaining = num_bits
+        shift = self.nbits - num_bits
+        result = self.buf >> shift
+        self.buf &= (1 << shift) - 1
+        self.nbits = shift
+        return result
+    
+    def peek_bits(self, num_bits: int) -> int:
+        if self.nbits < num_bits:
+            self._refill()
+            if self.nbits < num_bits:
+                # Pad with zeros past the end so prefix lookups still work
+                return self.buf << (num_bits - self.nbits)
         
-        while bits_remaining > 0:
-            if self.pos >= len(self.data):
-                return 0, False
+        return self.buf >> (self.nbits - num_bits)
+    
+    def read_zero_run(self, limit: int) -> int:
+        # Consume up to limit 0 bits plus the 1 bit that ends the run, and
+        # return the run length. Stops early, without error, at the end of
+        # the data so the next read raises EOFError.
+        run = 0
+        while True:
+            if self.nbits == 0:
+                self._refill()
+                if self.nbits == 0:
+                    return run
             
-            bits_left_in_byte = 8 - self.bit_pos
+            zeros = self.nbits - self.buf.bit_length()
+            if run + zeros >= limit:
+                self.nbits -= limit - run
+                return limit
             
-            if bits_remaining >= bits_left_in_byte:
-                mask = (1 << bits_left_in_byte) - 1
-                bits = (self.data[self.pos] >> (8 - bits_left_in_byte - self.bit_pos)) & mask
-                result = (result << bits_left_in_byte) | bits
-                bits_remaining -= bits_left_in_byte
-                self.pos += 1
-                self.bit_pos = 0
-            else:
-                shift = bits_left_in_byte - bits_remaining
-                mask = (1 << bits_remaining) - 1
-                bits = (self.data[self.pos] >> shift) & mask
-                result = (result << bits_remaining) | bits
-                self.bit_pos += bits_remaining
-                bits_remaining = 0
+            run += zeros
+            if self.buf:
+                self.nbits -= zeros + 1
+                self.buf &= (1 << self.nbits) - 1
+                return run
+            self.nbits = 0
+    
+    def consume(self, num_bits: int):
+        if self.nbits < num_bits:
+            raise EOFError("Unexpected end of compressed data")
         
-        return result, True
+        self.nbits -= num_bits
+        self.buf &= (1 << self.nbits) - 1
 
 
 def count_leading_zeros(x: int) -> int:
     if x == 0:
         return 64
-    n = 0
-    if x <= 0x00000000FFFFFFFF:
-        n += 32
-        x <<= 32
-    if x <= 0x0000FFFFFFFFFFFF:
-        n += 16
-        x <<= 16
-    if x <= 0x00FFFFFFFFFFFFFF:
-        n += 8
-        x <<= 8
-    if x <= 0x0FFFFFFFFFFFFFFF:
-        n += 4
-        x <<= 4
-    if x <= 0x3FFFFFFFFFFFFFFF:
-        n += 2
-        x <<= 2
-    if x <= 0x7FFFFFFFFFFFFFFF:
-        n += 1
-    return n
+    return 64 - x.bit_length()
 
 
 def count_trailing_zeros(x: int) -> int:
     if x == 0:
         return 64
-    n = 0
-    if (x & 0x00000000FFFFFFFF) == 0:
-        n += 32
-        x >>= 32
-    if (x & 0x000000000000FFFF) == 0:
-        n += 16
-        x >>= 16
-    if (x & 0x00000000000000FF) == 0:
-        n += 8
-        x >>= 8
-    if (x & 0x000000000000000F) == 0:
-        n += 4
-        x >>= 4
-    if (x & 0x0000000000000003) == 0:
-        n += 2
-        x >>= 2
-    if (x & 0x0000000000000001) == 0:
-        n += 1
-    return n
+    return (x & -x).bit_length() - 1
 
 
 def sign_extend(value: int, bits: int) -> int:
-    shift = 64 - bits
-    return ((value << shift) >> shift) & 0xFFFFFFFFFFFFFFFF
+    sign_bit = 1 << (bits - 1)
+    return (value ^ sign_bit) - sign_bit
+
+
+def wrap_int64(value: int) -> int:
+    return ((value + (1 << 63)) & 0xFFFFFFFFFFFFFFFF) - (1 << 63)
 
 
-def decompress_float64(data: bytes, count: int) -> List[float]:
+def decompress_float64(data: bytes, count: int) -> array:
+    result = array('d')
     if len(data) == 0 or count == 0:
-        return []
-    
-    br = BitReader(data)
-    result = []
-    
-    first_bits, ok = br.read_bits(64)
-    if not ok:
         return result
     
-    first_value = struct.unpack('d', struct.pack('Q', first_bits))[0]
-    result.append(first_value)
+    # The count comes from the footer; never allocate more samples than the
+    # stream can hold (64 bits for the first value, then at least 1 each)
+    count = min(count, 1 + max(0, (len(data) << 3) - 64))
     
-    if count == 1:
-        return result
+    br = BitReader(data)
+    read_bits = br.read_bits
+    read_zero_run = br.read_zero_run
+    raw_bits = array('Q', [0]) * count
+    i = 0
     
-    prev_value = first_bits
-    prev_leading = 0
-    prev_trailing = 0
-    
-    while len(result) < count:
-        control_bit, ok = br.read_bits(1)
-        if not ok:
-            break
-       
-        if control_bit == 0:
-            result.append(struct.unpack('d', struct.pack('Q', prev_value))[0])
-        else:
-            block_type, ok = br.read_bits(1)
-            if not ok:
-                break
-            if block_type == 0:
-                meaningful_bits = 64 - prev_leading - prev_trailing
-                bits, ok = br.read_bits(meaningful_bits)
-                if not ok:
+    try:
+        prev_value = read_bits(64)
+        raw_bits[0] = prev_value
+        i = 1
+        
+        prev_leading = 0
+        prev_trailing = 0
+        
+        while i < count:
+            # A run of 0 control bits repeats the previous value; fill it
+            # in one slice assignment. The 1 control bit ending the run is
+            # consumed as well, so the next bit is the block type.
+            run = read_zero_run(count - i)
+            if run:
+                if run == 1:
+                    raw_bits[i] = prev_value
+                else:
+                    raw_bits[i:i + run] = array('Q', (prev_value,)) * run
+                i += run
+                if i == count:
                     break
-                xor = bits << prev_trailing
+            
+            if read_bits(1) == 0:
+                meaningful_bits = 64 - prev_leading - prev_trailing
+                xor = read_bits(meaningful_bits) << prev_trailing
             else:
-                leading, ok = br.read_bits(6)
-                if not ok:
-                    break
-                meaningful_bits, ok = br.read_bits(6)
-                if not ok:
-                    break
-                bits, ok = br.read_bits(meaningful_bits)
-                if not ok:
-                    break
-                
+                header = read_bits(12)
+                leading = header >> 6
+                meaningful_bits = header & 0x3F
                 trailing = 64 - leading - meaningful_bits
-                xor = bits << trailing
+                xor = read_bits(meaningful_bits) << trailing
                 
                 prev_leading = leading
                 prev_trailing = trailing
             
-            prev_value = prev_value ^ xor
-            result.append(struct.unpack('d', struct.pack('Q', prev_value))[0])
+            prev_value ^= xor
+            raw_bits[i] = prev_value
+            i += 1
+    except EOFError:
+        del raw_bits[i:]
     
+    result.frombytes(memoryview(raw_bits).cast('B'))
     return result
 
 
-def decompress_int64(data: bytes, count: int) -> List[int]:
+def decompress_int64(data: bytes, count: int) -> array:
+    result = array('q')
     if len(data) == 0 or count == 0:
-        return []
-    
-    br = BitReader(data)
-    result = []
-    
-    first_value, ok = br.read_bits(64)
-    if not ok:
-        return result
-    
-    result.append(sign_extend(first_value, 64))
-    
-    if count == 1:
         return result
     
-    first_delta, ok = br.read_bits(64)
-    if not ok:
-        return result
-    
-    prev_value = sign_extend(first_value, 64) + sign_extend(first_delta, 64)
-    result.append(prev_value)
+    br = BitReader(data)
+    read_bits = br.read_bits
+    peek_bits = br.peek_bits
+    consume = br.consume
     
-    if count == 2:
+    try:
+        first_value = sign_extend(read_bits(64), 64)
+        result.append(first_value)
+        
+        if count == 1:
+            return result
+        
+        first_delta = sign_extend(read_bits(64), 64)
+    except EOFError:
         return result
     
-    prev_delta = sign_extend(first_delta, 64)
+    # The count comes from the footer; each remaining sample takes at least
+    # one bit after the two 64-bit seeds, so cap it before allocating
+    remaining = min(count - 2, max(0, (len(data) << 3) - 128))
     
-    while len(result) < count:
-        control_bit, ok = br.read_bits(1)
-        if not ok:
-            break
-        
-        if control_bit == 0:
-            delta_of_delta = 0
-        else:
-            second_bit, ok = br.read_bits(1)
-            if not ok:
-                break
-            
-            if second_bit == 0:
-                bits, ok = br.read_bits(7)
-                if not ok:
-                    break
-                delta_of_delta = sign_extend(bits, 7)
-            else:
-                third_bit, ok = br.read_bits(1)
-                if not ok:
-                    break
-                
-                if third_bit == 0:
-                    bits, ok = br.read_bits(9)
-                    if not ok:
-                        break
-                    delta_of_delta = sign_extend(bits, 9)
-                else:
-                    fourth_bit, ok = br.read_bits(1)
-                    if not ok:
-                        break
-                    
-                    if fourth_bit == 0:
-                        bits, ok = br.read_bits(12)
-                        if not ok:
-                            break
-                        delta_of_delta = sign_extend(bits, 12)
-                    else:
-                        bits, ok = br.read_bits(64)
-                        if not ok:
-                            break
-                        delta_of_delta = sign_extend(bits, 64)
-        
-        delta = prev_delta + delta_of_delta
-        value = prev_value + delta
-        result.append(value)
-        
-        prev_value = value
-        prev_delta = delta
+    # Zero-filled up front, so the common zero delta-of-delta needs no store
+    deltas_of_deltas = [0] * remaining
     
-    return result
+    try:
+        for i in range(remaining):
+            prefix_len, payload_bits, extend = _DOD_TABLE[peek_bits(5)]
+            consume(prefix_len)
+            if payload_bits:
+                deltas_of_deltas[i] = extend(read_bits(payload_bits))
+    except EOFError:
+        del deltas_of_deltas[i:]
+    
+    deltas = accumulate(deltas_of_deltas, initial=first_delta)
+    try:
+        return array('q', accumulate(deltas, initial=first_value))
+    except OverflowError:
+        # Go's int64 sums wrap around; only recompute with wrapping when a
+        # prefix sum actually leaves the int64 range
+        deltas = accumulate(deltas_of_deltas, initial=first_delta)
+        return array('q', map(wrap_int64, accumulate(deltas, initial=first_value)))
+
+
+def _parse_column(footer: memoryview, pos: int) -> Tuple[ColumnMeta, int]:
+    name_len = _LEN.unpack_from(footer, pos)[0]
+    pos += _LEN.size
+    name = str(footer[pos:pos+name_len], 'ascii', 'ignore')
+    pos += name_len
+    column_type, offset, size, count = _COL_TAIL.unpack_from(footer, pos)
+    return (name, column_type, offset, size, count), pos + _COL_TAIL.size
+
+
+def _parse_footer_fixed(footer: memoryview) -> Optional[Tuple[ColumnMeta, ColumnMeta]]:
+    # Fast path: the storage engine always writes the "timestamp" and
+    # "value" descriptors first, so their layout is fixed and both unpack
+    # in one call. Returns None when the names have other lengths.
+    if len(footer) < _FOOTER_FIXED.size:
+        return None
+    
+    fields = _FOOTER_FIXED.unpack_from(footer, 0)
+    if fields[2] != 9 or fields[8] != 5:
+        return None
+    
+    timestamp_column = (fields[3].decode('ascii', errors='ignore'),) + fields[4:8]
+    value_column = (fields[9].decode('ascii', errors='ignore'),) + fields[10:14]
+    return timestamp_column, value_column
+
+
+def _parse_footer_generic(footer: memoryview, num_columns: int) -> Tuple[ColumnMeta, ColumnMeta]:
+    # Timestamp and value always lead; later columns (device_id,
+    # metric_name, ...) and the trailing checksum are not decoded here
+    if num_columns < 2:
+        raise ValueError(f"Expected at least 2 columns, got {num_columns}")
+    
+    columns = []
+    pos = _FOOTER_HEAD.size
+    for _ in range(num_columns):
+        column, pos = _parse_column(footer, pos)
+        columns.append(column)
+    
+    return columns[0], columns[1]
 
 
-def read_parq_file(filepath: str) -> List[Tuple[int, float]]:
+def read_parq_file(filepath: str) -> Tuple[array, array]:
     with open(filepath, 'rb') as f:
-        data = f.read()
+        st = os.fstat(f.fileno())
+        if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+            # The mapping outlives the file handle and is unmapped once the
+            # last view into it is released.
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        else:
+            # Pipes, /dev/stdin and other streams cannot be mapped
+            data = memoryview(f.read())
     
     if len(data) < HEADER_SIZE + 4:
         raise ValueError("File too small")
     
     # Read header
-    magic = struct.unpack('<I', data[0:4])[0]
+    magic, format_version, record_count, num_columns, identifier = _HEADER.unpack_from(data, 0)
     if magic != MAGIC_NUMBER:
         raise ValueError(f"Invalid magic number: {hex(magic)}, expected {hex(MAGIC_NUMBER)}")
     
-    format_version = struct.unpack('<I', data[4:8])[0]
-    record_count = struct.unpack('<Q', data[8:16])[0]
-    num_columns = struct.unpack('<I', data[16:20])[0]
-    identifier = data[20:24].decode('ascii', errors='ignore')
+    identifier = identifier.decode('ascii', errors='ignore')
     
     print(f"Magic: {hex(magic)}")
     print(f"Format Version: {format_version}")
@@ -265,44 +326,25 @@ def read_parq_file(filepath: str) -> List[Tuple[int, float]]:
     print()
     
     footer_size_offset = len(data) - 4
-    footer_size = struct.unpack('<I', data[footer_size_offset:])[0]
+    footer_size = _LEN.unpack_from(data, footer_size_offset)[0]
     footer_start = footer_size_offset - footer_size
     
     if footer_start < HEADER_SIZE:
         raise ValueError("Invalid footer size")
     
     footer = data[footer_start:footer_size_offset]
-    metadata_version = struct.unpack('<I', footer[0:4])[0]
-    footer_num_columns = struct.unpack('<I', footer[4:8])[0]
-    
-    if footer_num_columns != 2:
-        raise ValueError(f"Expected 2 columns, got {footer_num_columns}")
-    
-    pos = 8
-    timestamp_name_len = struct.unpack('<I', footer[pos:pos+4])[0]
-    pos += 4
-    timestamp_name = footer[pos:pos+timestamp_name_len].decode('ascii', errors='ignore')
-    pos += timestamp_name_len
-    timestamp_type = struct.unpack('<I', footer[pos:pos+4])[0]
-    pos += 4
-    timestamp_offset = struct.unpack('<Q', footer[pos:pos+8])[0]
-    pos += 8
-    timestamp_size = struct.unpack('<Q', footer[pos:pos+8])[0]
-    pos += 8
-    timestamp_count = struct.unpack('<Q', footer[pos:pos+8])[0]
-    pos += 8
-    
-    value_name_len = struct.unpack('<I', footer[pos:pos+4])[0]
-    pos += 4
-    value_name = footer[pos:pos+value_name_len].decode('ascii', errors='ignore')
-    pos += value_name_len
-    value_type = struct.unpack('<I', footer[pos:pos+4])[0]
-    pos += 4
-    value_offset = struct.unpack('<Q', footer[pos:pos+8])[0]
-    pos += 8
-    value_size = struct.unpack('<Q', footer[pos:pos+8])[0]
-    pos += 8
-    value_count = struct.unpack('<Q', footer[pos:pos+8])[0]
+    metadata_version, footer_num_columns = _FOOTER_HEAD.unpack_from(footer, 0)
+    
+    # Any footer with at least two columns is accepted: timestamp and value
+    # lead, and the device_id/metric_name columns and trailing checksum that
+    # storage_engine.go appends are skipped
+    columns = _parse_footer_fixed(footer) if footer_num_columns >= 2 else None
+    if columns is None:
+        columns = _parse_footer_generic(footer, footer_num_columns)
+    timestamp_column, value_column = columns
+    
+    timestamp_name, timestamp_type, timestamp_offset, timestamp_size, timestamp_count = timestamp_column
+    value_name, value_type, value_offset, value_size, value_count = value_column
     
     print(f"Timestamp Column: {timestamp_name} (offset={timestamp_offset}, size={timestamp_size}, count={timestamp_count})")
     print(f"Value Column: {value_name} (offset={value_offset}, size={value_size}, count={value_count})")
@@ -316,17 +358,52 @@ def read_parq_file(filepath: str) -> List[Tuple[int, float]]:
     value_compressed = data[value_data_start:value_data_start + value_size - 8]
     values = decompress_float64(value_compressed, int(value_count))
     
-    records = list(zip(timestamps, values))
+    # Keep the two columns aligned even if one stream was cut short
+    aligned = min(len(timestamps), len(values))
+    del timestamps[aligned:]
+    del values[aligned:]
     
-    return records
+    return timestamps, values
 
 
 def format_timestamp(ts: int) -> str:
     try:
-        dt = datetime.fromtimestamp(ts)
-        return dt.strftime('%Y-%m-%d %H:%M:%S')
-    except (ValueError, OSError):
+        tm = time.localtime(ts)
+    except (ValueError, OSError, OverflowError):
         return str(ts)
+    # Same range datetime.fromtimestamp accepts, e.g. millisecond
+    # timestamps stay raw numbers
+    if not 1 <= tm.tm_year <= 9999:
+        return str(ts)
+    return time.strftime(TIMESTAMP_FORMAT, tm)
+
+
+def format_timestamps(timestamps) -> List[str]:
+    if len(timestamps) == 0:
+        return []
+    
+    # Neighbouring samples often fall in the same second, so only the first
+    # timestamp of each run is formatted, then repeated for the whole run
+    changed = list(map(ne, timestamps[1:], timestamps[:-1]))
+    heads = [timestamps[0]]
+    heads.extend(compress(timestamps[1:], changed))
+    
+    # The year grows with the timestamp, so checking the extremes covers
+    # every run head
+    try:
+        in_range = all(1 <= time.localtime(ts).tm_year <= 9999 for ts in (min(heads), max(heads)))
+    except (ValueError, OSError, OverflowError):
+        in_range = False
+    
+    if in_range:
+        formatted = list(map(time.strftime, repeat(TIMESTAMP_FORMAT), map(time.localtime, heads)))
+    else:
+        # Out-of-range values fall back to the raw number one by one
+        formatted = [format_timestamp(ts) for ts in heads]
+    
+    if len(formatted) == len(timestamps):
+        return formatted
+    return list(map(formatted.__getitem__, accumulate(changed, initial=0)))
 
 
 def main():
@@ -338,7 +415,7 @@ def main():
     filepath = sys.argv[1]
     
     try:
-        records = read_parq_file(filepath)
+        timestamps, values = read_parq_file(filepath)
         
         print(f"\n{'='*80}")
         print(f"Data from {filepath}")
@@ -346,11 +423,14 @@ def main():
         print(f"{'Index':<8} {'Timestamp':<20} {'Unix Time':<15} {'Value':<15}")
         print(f"{'-'*80}")
         
-        for i, (timestamp, value) in enumerate(records):
-            print(f"{i+1:<8} {format_timestamp(timestamp):<20} {timestamp:<15} {value:<15.6f}")
+        sys.stdout.write(''.join(
+            f"{i:<8} {formatted:<20} {timestamp:<15} {value:<15.6f}\n"
+            for i, (formatted, timestamp, value) in enumerate(
+                zip(format_timestamps(timestamps), timestamps, values), 1)
+        ))
         
         print(f"{'='*80}")
-        print(f"Total records: {len(records)}")
+        print(f"Total records: {len(timestamps)}")
         
     except Exception as e:
         print(f"Error reading file: {e}", file=sys.stderr)